@@ -0,0 +1,8 @@
+"""
+Pytest configuration for STT service tests
+"""
+
+import os
+
+# Keep the test run offline: don't download/load Whisper weights on import
+os.environ.setdefault("WHISPER_PRELOAD", "false")
@@ -1,18 +1,42 @@
 """
 JarvisX STT Service
-Speech-to-Text service using OpenAI Whisper for Sinhala and English transcription
+Speech-to-Text service using faster-whisper (CTranslate2) for Sinhala and English transcription
 """
 
+import asyncio
+import bisect
+import functools
+import hashlib
 import os
-import tempfile
+import time
 import logging
-from typing import Optional
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, List, NamedTuple, Optional
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import whisper
 import uvicorn
 
+# Number of transcriptions allowed on the model at once. Each one runs in its
+# own CTranslate2 worker with CPU_THREADS intra-op threads, so together they
+# use every core once instead of oversubscribing it. The OpenMP/BLAS pools
+# read their size at import, so pin them before numpy/ctranslate2 load.
+GPU_CONCURRENCY = int(os.getenv("GPU_CONCURRENCY", "2"))
+CPU_THREADS = int(
+    os.getenv("WHISPER_CPU_THREADS", max(1, (os.cpu_count() or 4) // GPU_CONCURRENCY))
+)
+for _thread_var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ.setdefault(_thread_var, str(CPU_THREADS))
+
+# These must follow the thread pinning above
+import numpy as np  # noqa: E402
+import ctranslate2  # noqa: E402
+from faster_whisper import BatchedInferencePipeline, WhisperModel  # noqa: E402
+from faster_whisper.audio import decode_audio  # noqa: E402
+from faster_whisper.vad import VadOptions, get_speech_timestamps, merge_segments  # noqa: E402
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,163 +57,1138 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global Whisper model
-whisper_model = None
+# Whisper operates on 16 kHz mono audio in 30 second windows
+SAMPLE_RATE = 16000
+CHUNK_SECONDS = 30
+
+# Audio container extensions accepted for upload (without the leading dot)
+ALLOWED_EXTENSIONS = frozenset({"wav", "mp3", "m4a", "flac", "ogg", "webm"})
+_ALLOWED_EXTENSIONS_LABEL = ", ".join(f".{ext}" for ext in sorted(ALLOWED_EXTENSIONS))
+
+# Uploads are hashed in 1 MiB chunks through one reusable buffer, so
+# per-request RSS stays bounded regardless of upload size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Maximum number of 30 s windows decoded together by the batched pipeline
+BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", "16"))
+
+# Minimum silence that splits speech regions when VAD chunks long audio
+VAD_MIN_SILENCE_MS = int(os.getenv("VAD_MIN_SILENCE_MS", "500"))
+
+# /stream re-transcribes its buffer after every STREAM_STEP_SECONDS of new
+# audio and never keeps more than STREAM_BUFFER_SECONDS of it
+STREAM_STEP_SECONDS = float(os.getenv("STREAM_STEP_SECONDS", "1.0"))
+STREAM_BUFFER_SECONDS = float(os.getenv("STREAM_BUFFER_SECONDS", "30"))
+
+# Display names for /languages. Which codes a request may use comes from
+# the loaded model's supported_languages (["en"] for .en models).
+LANGUAGE_NAMES = {
+    "en": "English",
+    "zh": "Chinese",
+    "de": "German",
+    "es": "Spanish",
+    "ru": "Russian",
+    "ko": "Korean",
+    "fr": "French",
+    "ja": "Japanese",
+    "pt": "Portuguese",
+    "tr": "Turkish",
+    "pl": "Polish",
+    "ca": "Catalan",
+    "nl": "Dutch",
+    "ar": "Arabic",
+    "sv": "Swedish",
+    "it": "Italian",
+    "id": "Indonesian",
+    "hi": "Hindi",
+    "fi": "Finnish",
+    "vi": "Vietnamese",
+    "he": "Hebrew",
+    "uk": "Ukrainian",
+    "el": "Greek",
+    "ms": "Malay",
+    "cs": "Czech",
+    "ro": "Romanian",
+    "da": "Danish",
+    "hu": "Hungarian",
+    "ta": "Tamil",
+    "no": "Norwegian",
+    "th": "Thai",
+    "ur": "Urdu",
+    "hr": "Croatian",
+    "bg": "Bulgarian",
+    "lt": "Lithuanian",
+    "la": "Latin",
+    "mi": "Maori",
+    "ml": "Malayalam",
+    "cy": "Welsh",
+    "sk": "Slovak",
+    "te": "Telugu",
+    "fa": "Persian",
+    "lv": "Latvian",
+    "bn": "Bengali",
+    "sr": "Serbian",
+    "az": "Azerbaijani",
+    "sl": "Slovenian",
+    "kn": "Kannada",
+    "et": "Estonian",
+    "mk": "Macedonian",
+    "br": "Breton",
+    "eu": "Basque",
+    "is": "Icelandic",
+    "hy": "Armenian",
+    "ne": "Nepali",
+    "mn": "Mongolian",
+    "bs": "Bosnian",
+    "kk": "Kazakh",
+    "sq": "Albanian",
+    "sw": "Swahili",
+    "gl": "Galician",
+    "mr": "Marathi",
+    "pa": "Punjabi",
+    "si": "Sinhala",
+    "km": "Khmer",
+    "sn": "Shona",
+    "yo": "Yoruba",
+    "so": "Somali",
+    "af": "Afrikaans",
+    "oc": "Occitan",
+    "ka": "Georgian",
+    "be": "Belarusian",
+    "tg": "Tajik",
+    "sd": "Sindhi",
+    "gu": "Gujarati",
+    "am": "Amharic",
+    "yi": "Yiddish",
+    "lo": "Lao",
+    "uz": "Uzbek",
+    "fo": "Faroese",
+    "ht": "Haitian Creole",
+    "ps": "Pashto",
+    "tk": "Turkmen",
+    "nn": "Nynorsk",
+    "mt": "Maltese",
+    "sa": "Sanskrit",
+    "lb": "Luxembourgish",
+    "my": "Myanmar",
+    "bo": "Tibetan",
+    "tl": "Tagalog",
+    "mg": "Malagasy",
+    "as": "Assamese",
+    "tt": "Tatar",
+    "haw": "Hawaiian",
+    "ln": "Lingala",
+    "ha": "Hausa",
+    "ba": "Bashkir",
+    "jw": "Javanese",
+    "su": "Sundanese",
+    "yue": "Cantonese"
+}
+
+# Decoding presets selectable per request. "fast" decodes greedily without
+# conditioning on the previous window's text, which is several times cheaper
+# than beam search at a small accuracy cost; "accurate" is Whisper's default.
+DECODE_PRESETS = {
+    "fast": {
+        "beam_size": 1,
+        "best_of": 1,
+        "condition_on_previous_text": False,
+        "temperature": 0.0
+    },
+    "accurate": {
+        "beam_size": 5,
+        "best_of": 5,
+        "condition_on_previous_text": True
+    }
+}
+DEFAULT_QUALITY = os.getenv("WHISPER_QUALITY", "fast")
+if DEFAULT_QUALITY not in DECODE_PRESETS:
+    raise ValueError(
+        f"Unknown WHISPER_QUALITY: {DEFAULT_QUALITY}. Allowed: {list(DECODE_PRESETS)}"
+    )
+
+# Requests beyond GPU_CONCURRENCY wait on the semaphore instead of
+# contending for the device
+_inference_semaphore = asyncio.Semaphore(GPU_CONCURRENCY)
+
+# Inference gets one thread per semaphore slot, so every admitted request
+# starts at once. Hashing and decoding run on a separate pool (half the
+# cores by default) so cache hits never queue behind a transcription.
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", max(1, (os.cpu_count() or 2) // 2)))
+_executor = ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="stt-io")
+_inference_executor = ThreadPoolExecutor(
+    max_workers=GPU_CONCURRENCY,
+    thread_name_prefix="stt-inference"
+)
+
+# LRU of finished transcriptions keyed by upload digest and decode options,
+# so re-sent audio skips inference entirely (0 disables the cache)
+TRANSCRIPTION_CACHE_SIZE = int(os.getenv("TRANSCRIPTION_CACHE_SIZE", "1024"))
+_transcription_cache: "OrderedDict[tuple, dict]" = OrderedDict()
+
+# Languages auto-detected per client session, so later "auto" requests
+# from the same session skip Whisper's language detection pass
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "4096"))
+_session_languages: "OrderedDict[str, str]" = OrderedDict()
+
+# Model sizes that requests may select, and the one used when none is given
+AVAILABLE_MODELS = [
+    size.strip() for size in os.getenv("WHISPER_MODELS", "tiny,base,small").split(",")
+    if size.strip()
+]
+DEFAULT_MODEL = os.getenv("WHISPER_MODEL_SIZE", "base")
+if DEFAULT_MODEL not in AVAILABLE_MODELS:
+    AVAILABLE_MODELS.append(DEFAULT_MODEL)
+
+# Non-default models unused for this long are dropped to free memory and
+# reloaded on their next request
+MODEL_IDLE_TTL = int(os.getenv("WHISPER_MODEL_IDLE_TTL", "3600"))
+
+# Run decoder self-attention through CTranslate2's fused FlashAttention-2
+# kernel on CUDA (needs an Ampere or newer GPU)
+FLASH_ATTENTION = os.getenv("WHISPER_FLASH_ATTENTION", "false").lower() == "true"
+
+# Inference engine: "faster-whisper" (CTranslate2, default) or "openvino"
+# for CPU/iGPU hosts. The OpenVINO backend needs the optional openvino-genai
+# package and models exported ahead of time, e.g.
+#   optimum-cli export openvino --model openai/whisper-base \
+#       --weight-format int8 models/openvino/whisper-base
+STT_BACKEND = os.getenv("STT_BACKEND", "faster-whisper").lower()
+OPENVINO_MODEL_DIR = os.getenv("OPENVINO_MODEL_DIR", "models/openvino")
+OPENVINO_DEVICE = os.getenv("OPENVINO_DEVICE", "CPU")
+
+class OpenVINOSegment(NamedTuple):
+    start: float
+    end: float
+    text: str
+    words: Optional[list] = None
+
+class OpenVINOInfo(NamedTuple):
+    language: Optional[str]
+    duration: float
+
+class OpenVINOWhisperModel:
+    """
+    OpenVINO GenAI WhisperPipeline behind the faster-whisper transcribe() interface
+    
+    Decode options that only apply to faster-whisper (beam size, VAD, ...) are
+    accepted and ignored; the pipeline handles long-form audio itself. The
+    pipeline does not report the language it detects, so requests on this
+    backend must name one ("auto" is rejected).
+    """
+    
+    def __init__(self, model_size: str):
+        try:
+            import openvino_genai
+        except ImportError as e:
+            raise RuntimeError("STT_BACKEND=openvino requires the openvino-genai package") from e
+        
+        model_dir = os.path.join(OPENVINO_MODEL_DIR, f"whisper-{model_size}")
+        self.pipeline = openvino_genai.WhisperPipeline(model_dir, device=OPENVINO_DEVICE)
+        # A pipeline instance is not safe to call from several threads at once
+        self._lock = threading.Lock()
+    
+    @property
+    def supported_languages(self) -> List[str]:
+        """WhisperPipeline does not report its languages, so accept every Whisper code"""
+        return list(LANGUAGE_NAMES)
+    
+    def transcribe(self, audio: np.ndarray, language: Optional[str] = None, **options) -> tuple:
+        """Transcribe a 16 kHz waveform, returning (segments, info) like faster-whisper"""
+        generate_options = {"return_timestamps": True}
+        if language:
+            generate_options["language"] = f"<|{language}|>"
+        
+        with self._lock:
+            result = self.pipeline.generate(audio.tolist(), **generate_options)
+        
+        segments = [
+            OpenVINOSegment(chunk.start_ts, chunk.end_ts, chunk.text)
+            for chunk in result.chunks or []
+        ]
+        return iter(segments), OpenVINOInfo(language, len(audio) / SAMPLE_RATE)
+
+# CTranslate2 precision, in order of preference per device: INT8 weights with
+# FP16 activations on GPU, INT8 on CPU (AVX-VNNI / Apple Accelerate).
+# WHISPER_COMPUTE_TYPE overrides the automatic choice.
+COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE")
+_COMPUTE_TYPE_PREFERENCE = {
+    "cuda": ["int8_float16", "float16", "int8", "float32"],
+    "cpu": ["int8", "int8_float32", "float32"]
+}
+
+# Loaded Whisper models by size, and when each was last used
+whisper_models: Dict[str, object] = {}
+_model_last_used: Dict[str, float] = {}
+_model_load_lock = asyncio.Lock()
+
+def _select_compute_type(device: str) -> str:
+    """Pick the fastest compute type the device supports, unless overridden"""
+    if COMPUTE_TYPE:
+        return COMPUTE_TYPE
+    supported = ctranslate2.get_supported_compute_types(device)
+    for compute_type in _COMPUTE_TYPE_PREFERENCE[device]:
+        if compute_type in supported:
+            return compute_type
+    return "default"
+
+def _load_faster_whisper_model(model_size: str) -> WhisperModel:
+    """Load a CTranslate2 Whisper model on the best available device"""
+    device = "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+    compute_type = _select_compute_type(device)
+    flash_attention = FLASH_ATTENTION and device == "cuda"
+    logger.info(
+        f"Loading Whisper model: {model_size} ({device}, {compute_type}"
+        f"{', flash attention' if flash_attention else ''})"
+    )
+    return WhisperModel(
+        model_size,
+        device=device,
+        compute_type=compute_type,
+        cpu_threads=CPU_THREADS,
+        num_workers=GPU_CONCURRENCY,
+        flash_attention=flash_attention
+    )
+
+def _warm_up_model(model):
+    """
+    Run one throwaway transcription of 1 s of silence
+    
+    This pays device context creation, kernel selection and allocator growth
+    before the first real request. VAD is disabled so the decoder runs too.
+    """
+    segments, _ = model.transcribe(
+        np.zeros(SAMPLE_RATE, dtype=np.float32),
+        language="en",
+        vad_filter=False
+    )
+    list(segments)
 
-def load_whisper_model():
-    """Load Whisper model on startup"""
-    global whisper_model
+def load_whisper_model(model_size: str = DEFAULT_MODEL):
+    """
+    Load and warm up a Whisper model for the configured backend
+    
+    The model is registered in whisper_models only once warm, so /health
+    reports model_loaded after the warmup pass rather than after loading.
+    """
     try:
-        model_size = os.getenv("WHISPER_MODEL_SIZE", "medium")
-        logger.info(f"Loading Whisper model: {model_size}")
-        whisper_model = whisper.load_model(model_size)
-        logger.info("Whisper model loaded successfully")
+        if STT_BACKEND == "openvino":
+            logger.info(f"Loading OpenVINO Whisper model: {model_size} ({OPENVINO_DEVICE})")
+            model = OpenVINOWhisperModel(model_size)
+        elif STT_BACKEND == "faster-whisper":
+            model = _load_faster_whisper_model(model_size)
+        else:
+            raise ValueError(f"Unknown STT_BACKEND: {STT_BACKEND}")
+        
+        _warm_up_model(model)
+        whisper_models[model_size] = model
+        _model_last_used[model_size] = time.monotonic()
+        logger.info(f"Whisper model {model_size} loaded and warmed up")
+        return model
     except Exception as e:
-        logger.error(f"Failed to load Whisper model: {e}")
+        logger.error(f"Failed to load Whisper model {model_size}: {e}")
         raise
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize services on startup"""
-    load_whisper_model()
+def _evict_idle_models():
+    """Drop non-default models that have not been used within MODEL_IDLE_TTL"""
+    now = time.monotonic()
+    for model_size, last_used in list(_model_last_used.items()):
+        if model_size != DEFAULT_MODEL and now - last_used > MODEL_IDLE_TTL:
+            whisper_models.pop(model_size, None)
+            del _model_last_used[model_size]
+            logger.info(f"Evicted idle Whisper model: {model_size}")
+
+async def _get_model(model_size: str):
+    """Return the requested model, loading it if it was evicted or never preloaded"""
+    if model_size not in AVAILABLE_MODELS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported model: {model_size}. Allowed: {AVAILABLE_MODELS}"
+        )
+    _evict_idle_models()
+    model = whisper_models.get(model_size)
+    if model is None:
+        async with _model_load_lock:
+            model = whisper_models.get(model_size)
+            if model is None:
+                try:
+                    model = await _run_blocking(load_whisper_model, model_size)
+                except Exception as e:
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"Failed to load model {model_size}: {str(e)}"
+                    )
+    _model_last_used[model_size] = time.monotonic()
+    return model
+
+# Load weights at import time so the first request doesn't pay the cold load.
+# "python main.py" imports this module a second time through uvicorn, so skip
+# the __main__ copy to avoid holding the models twice.
+if __name__ != "__main__" and os.getenv("WHISPER_PRELOAD", "true").lower() == "true":
+    for model_size in AVAILABLE_MODELS:
+        load_whisper_model(model_size)
+
+def _validate_file_type(filename: Optional[str]) -> str:
+    """Return the lowercased extension of filename, rejecting non-audio files"""
+    filename = filename or ""
+    file_ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400, 
+            detail=(
+                f"Unsupported file type: {'.' + file_ext if file_ext else 'none'}. "
+                f"Allowed: {_ALLOWED_EXTENSIONS_LABEL}"
+            )
+        )
+    return file_ext
+
+def _resolve_language(
+    language: Optional[str],
+    supported_languages: List[str],
+    session_id: Optional[str] = None
+) -> Optional[str]:
+    """
+    Map a requested language to the code handed to Whisper
+    
+    Explicit codes are checked against the model's supported languages and
+    passed through so detection is skipped. "auto" reuses the language
+    detected earlier in the same session, or returns None to let Whisper
+    detect it.
+    """
+    if language and language != "auto":
+        if language not in supported_languages:
+            raise HTTPException(status_code=400, detail=f"Unsupported language: {language}")
+        return language
+    
+    if STT_BACKEND == "openvino":
+        raise HTTPException(
+            status_code=400,
+            detail="Language auto-detection is not supported by the OpenVINO backend"
+        )
+    
+    if session_id and session_id in _session_languages:
+        _session_languages.move_to_end(session_id)
+        return _session_languages[session_id]
+    return None
+
+def _remember_language(session_id: Optional[str], language: Optional[str]):
+    """Record the language detected for a session, evicting the oldest sessions"""
+    if not session_id or not language:
+        return
+    _session_languages[session_id] = language
+    _session_languages.move_to_end(session_id)
+    while len(_session_languages) > SESSION_CACHE_SIZE:
+        _session_languages.popitem(last=False)
+
+def _decode_options(quality: str) -> dict:
+    """Return the decoding options for a quality preset"""
+    if quality not in DECODE_PRESETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported quality: {quality}. Allowed: {list(DECODE_PRESETS)}"
+        )
+    return dict(DECODE_PRESETS[quality])
+
+def _hash_upload(stream: BinaryIO) -> str:
+    """
+    Hash an upload stream in place and rewind it for decoding
+    
+    Starlette already spools the request body into a SpooledTemporaryFile,
+    so this reads it through a single reusable buffer instead of copying it.
+    
+    Returns:
+        The BLAKE2b hex digest of the stream content
+    """
+    digest = hashlib.blake2b()
+    buffer = bytearray(UPLOAD_CHUNK_SIZE)
+    view = memoryview(buffer)
+    stream.seek(0)
+    while size := stream.readinto(buffer):
+        digest.update(view[:size])
+    stream.seek(0)
+    return digest.hexdigest()
+
+async def _decode_upload(file: UploadFile) -> np.ndarray:
+    """
+    Decode an upload stream to a 16 kHz mono float32 waveform
+    
+    PyAV reads the spooled upload in-process, so the body is neither copied
+    nor re-read through an ffmpeg subprocess.
+    """
+    return await _run_blocking(decode_audio, file.file, sampling_rate=SAMPLE_RATE)
+
+async def _load_upload(file: UploadFile, cache_options: tuple) -> tuple:
+    """
+    Look an upload up in the transcription cache, decoding it only on a miss
+    
+    Args:
+        file: Uploaded audio file
+        cache_options: Decode path and options that, with the content digest,
+            form the cache key
+    
+    Returns:
+        (cache_key, cached result or None, waveform or None)
+    """
+    digest = await _run_blocking(_hash_upload, file.file)
+    cache_key = (digest, *cache_options)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cache_key, cached, None
+    return cache_key, None, await _decode_upload(file)
+
+def _cache_get(key: tuple) -> Optional[dict]:
+    """Return a cached transcription and mark it most recently used"""
+    result = _transcription_cache.get(key)
+    if result is not None:
+        _transcription_cache.move_to_end(key)
+    return result
+
+def _cache_put(key: tuple, result: dict):
+    """Store a transcription, evicting the least recently used entries"""
+    if TRANSCRIPTION_CACHE_SIZE <= 0:
+        return
+    _transcription_cache[key] = result
+    _transcription_cache.move_to_end(key)
+    while len(_transcription_cache) > TRANSCRIPTION_CACHE_SIZE:
+        _transcription_cache.popitem(last=False)
+
+async def _run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the I/O pool so the event loop stays responsive"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+async def _run_inference(func, *args, **kwargs):
+    """Run a model call on the inference pool, bounded by the inference semaphore"""
+    loop = asyncio.get_running_loop()
+    async with _inference_semaphore:
+        return await loop.run_in_executor(
+            _inference_executor,
+            functools.partial(func, *args, **kwargs)
+        )
+
+def _run_transcribe(model, audio: np.ndarray, **options) -> tuple:
+    """Run a model or pipeline and drain its lazy segment generator so decoding finishes here"""
+    segments, info = model.transcribe(audio, **options)
+    return list(segments), info
+
+def _core_transcribe(
+    model,
+    audio: np.ndarray,
+    language: Optional[str],
+    timestamp: bool = False,
+    **options
+) -> dict:
+    """
+    Transcribe one decoded clip into the result dict shared by the endpoints
+    
+    Args:
+        model: Loaded Whisper model
+        audio: 16 kHz float32 waveform
+        language: Language code, or None to auto-detect
+        timestamp: Whether to include segment timestamps
+        **options: Decoding options (see DECODE_PRESETS)
+    
+    Returns:
+        Dict with text, language, duration and optionally segments
+    """
+    options = {
+        "language": language,
+        "word_timestamps": timestamp,
+        **options,
+        "vad_filter": True,
+        "vad_parameters": {"min_silence_duration_ms": VAD_MIN_SILENCE_MS}
+    }
+    
+    if STT_BACKEND == "faster-whisper" and len(audio) > SAMPLE_RATE * CHUNK_SECONDS:
+        # Long audio: VAD splits it into <=30 s speech regions that are
+        # decoded together in batches instead of one window at a time
+        transcriber = BatchedInferencePipeline(model=model)
+        options["batch_size"] = BATCH_SIZE
+        # The pipeline drops timestamp tokens by default, which would leave
+        # one segment per VAD region instead of per phrase
+        options["without_timestamps"] = not timestamp
+    else:
+        transcriber = model
+    
+    segments, info = _run_transcribe(transcriber, audio, **options)
+    result = {
+        "text": "".join(segment.text for segment in segments).strip(),
+        "language": info.language,
+        "duration": len(audio) / SAMPLE_RATE
+    }
+    
+    if timestamp:
+        result["segments"] = [
+            {
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text
+            }
+            for segment in segments
+        ]
+    return result
+
+def _transcribe_sequential(
+    model,
+    audios: List[np.ndarray],
+    language: Optional[str],
+    **options
+) -> List[dict]:
+    """Transcribe clips one after another, for backends without batched decoding"""
+    return [_core_transcribe(model, audio, language, **options) for audio in audios]
+
+
+def _speech_regions(audio: np.ndarray) -> List[dict]:
+    """
+    Split a clip into speech regions of at most CHUNK_SECONDS with Silero VAD
+    
+    Uses the same VAD settings as the single-file path, so silence is never
+    decoded and regions end in pauses rather than at fixed 30 s marks.
+    
+    Returns:
+        Dicts with "start" and "end" sample positions within the clip
+    """
+    vad_options = VadOptions(
+        max_speech_duration_s=CHUNK_SECONDS,
+        min_silence_duration_ms=VAD_MIN_SILENCE_MS
+    )
+    speech = get_speech_timestamps(audio, vad_options, sampling_rate=SAMPLE_RATE)
+    return [
+        {"start": region["start"], "end": region["end"]}
+        for region in merge_segments(speech, vad_options, sampling_rate=SAMPLE_RATE)
+    ]
+
+def _transcribe_batched(
+    pipeline: BatchedInferencePipeline,
+    audios: List[np.ndarray],
+    language: Optional[str],
+    **options
+) -> List[dict]:
+    """
+    Transcribe several clips with one batched decode
+    
+    Every clip is split into speech regions by VAD and the clips are laid out
+    back to back, so the batched pipeline pushes regions from all files
+    through the encoder/decoder together. Segments are mapped back to their
+    clip by start sample.
+    
+    Args:
+        pipeline: Batched pipeline wrapping the model to decode with
+        audios: 16 kHz float32 waveforms
+        language: Language code, or None to auto-detect
+        **options: Extra decoding options passed to the pipeline
+    
+    Returns:
+        One result dict per clip, in input order
+    """
+    offsets = []
+    clip_timestamps = []
+    position = 0
+    for audio in audios:
+        offsets.append(position)
+        for region in _speech_regions(audio):
+            clip_timestamps.append({
+                "start": position + region["start"],
+                "end": position + region["end"]
+            })
+        position += len(audio)
+    
+    texts = [[] for _ in audios]
+    detected_language = language
+    if clip_timestamps:
+        segments, info = pipeline.transcribe(
+            np.concatenate(audios),
+            language=language,
+            clip_timestamps=clip_timestamps,
+            batch_size=BATCH_SIZE,
+            # Detect the language per region rather than from the first file only
+            multilingual=language is None,
+            **options
+        )
+        # Segment starts are rounded to the millisecond, so a clip's first
+        # segment can land up to 8 samples before the clip's offset
+        tolerance = SAMPLE_RATE // 1000
+        for segment in segments:
+            start = round(segment.start * SAMPLE_RATE) + tolerance
+            texts[bisect.bisect_right(offsets, start) - 1].append(segment.text)
+        detected_language = info.language
+    
+    return [
+        {
+            "text": "".join(text).strip(),
+            "language": detected_language,
+            "duration": len(audio) / SAMPLE_RATE
+        }
+        for text, audio in zip(texts, audios)
+    ]
+
+class StreamWord(NamedTuple):
+    start: float
+    end: float
+    text: str
+
+class LocalAgreement:
+    """
+    LocalAgreement-2 commit policy for streaming transcription
+    
+    Each round re-transcribes the audio buffer and yields a hypothesis. A word
+    is committed once two consecutive hypotheses agree on it; everything past
+    the agreed prefix stays tentative until the next round.
+    """
+    
+    def __init__(self):
+        self.committed: List[StreamWord] = []
+        self._tentative: List[StreamWord] = []
+    
+    @property
+    def committed_end(self) -> float:
+        """End time of the last committed word, in stream seconds"""
+        return self.committed[-1].end if self.committed else 0.0
+    
+    def insert(self, words: List[StreamWord]) -> tuple:
+        """
+        Feed a new hypothesis
+        
+        Returns:
+            The newly committed words and the remaining tentative words
+        """
+        words = [word for word in words if word.start >= self.committed_end - 0.1]
+        
+        # Whisper often repeats the tail of the committed text at the start of
+        # a re-transcribed buffer; drop up to 5 words of such overlap
+        for size in range(min(5, len(self.committed), len(words)), 0, -1):
+            tail = [_normalize_word(word.text) for word in self.committed[-size:]]
+            if tail == [_normalize_word(word.text) for word in words[:size]]:
+                words = words[size:]
+                break
+        
+        agreed = []
+        for current, previous in zip(words, self._tentative):
+            if _normalize_word(current.text) != _normalize_word(previous.text):
+                break
+            agreed.append(current)
+        
+        self.committed.extend(agreed)
+        self._tentative = words[len(agreed):]
+        return agreed, self._tentative
+    
+    def flush(self) -> List[StreamWord]:
+        """Commit whatever is still tentative at the end of the stream"""
+        remaining, self._tentative = self._tentative, []
+        self.committed.extend(remaining)
+        return remaining
+
+class StreamBuffer:
+    """
+    Growable float32 audio buffer for /stream
+    
+    Frames are written into spare capacity, which doubles when it runs out,
+    so appending does not copy the whole buffer on every frame.
+    """
+    
+    def __init__(self, capacity: int):
+        self._data = np.empty(capacity, dtype=np.float32)
+        self._size = 0
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    @property
+    def audio(self) -> np.ndarray:
+        """View of the buffered samples; only valid until the next append or drop"""
+        return self._data[:self._size]
+    
+    def append(self, samples: np.ndarray):
+        end = self._size + len(samples)
+        if end > len(self._data):
+            grown = np.empty(max(end, 2 * len(self._data)), dtype=np.float32)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:end] = samples
+        self._size = end
+    
+    def drop(self, count: int):
+        """Discard the oldest count samples"""
+        remaining = self._size - count
+        self._data[:remaining] = self._data[count:self._size]
+        self._size = remaining
+
+def _normalize_word(text: str) -> str:
+    return text.strip().lower()
+
+def _join_words(words: List[StreamWord]) -> str:
+    return "".join(word.text for word in words).strip()
+
+def _stream_hypothesis(
+    model,
+    buffer: np.ndarray,
+    buffer_offset: float,
+    language: Optional[str],
+    prompt: str,
+    **options
+) -> tuple:
+    """
+    Transcribe the stream buffer
+    
+    Returns:
+        Its words on the stream timeline, and the language they were decoded in
+    """
+    segments, info = _run_transcribe(
+        model,
+        buffer,
+        language=language,
+        word_timestamps=True,
+        initial_prompt=prompt or None,
+        **options
+    )
+    words = []
+    for segment in segments:
+        # Backends without word timings fall back to whole segments
+        for word in segment.words or [segment]:
+            text = getattr(word, "word", None) or word.text
+            words.append(StreamWord(buffer_offset + word.start, buffer_offset + word.end, text))
+    return words, info.language
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy", "service": "stt", "model_loaded": whisper_model is not None}
+    return {
+        "status": "healthy",
+        "service": "stt",
+        "backend": STT_BACKEND,
+        "model_loaded": DEFAULT_MODEL in whisper_models,
+        "models": list(whisper_models)
+    }
 
 @app.post("/transcribe")
 async def transcribe_audio(
     file: UploadFile = File(...),
     language: Optional[str] = Form("si"),  # Default to Sinhala
-    timestamp: bool = Form(False)
+    timestamp: bool = Form(False),
+    model: str = Form(DEFAULT_MODEL),
+    session_id: Optional[str] = Form(None),
+    quality: str = Form(DEFAULT_QUALITY)
 ):
     """
     Transcribe audio file to text
     
     Args:
         file: Audio file (wav, mp3, m4a, etc.)
-        language: Language code (si for Sinhala, en for English)
+        language: Language code (si for Sinhala, en for English, auto to detect)
         timestamp: Whether to include timestamps in response
+        model: Whisper model size to use (see WHISPER_MODELS)
+        session_id: Client session; auto-detected languages are reused within it
+        quality: Decoding preset, "fast" (greedy) or "accurate" (beam search)
     
     Returns:
         JSON with transcribed text and metadata
     """
-    if not whisper_model:
-        raise HTTPException(status_code=500, detail="Whisper model not loaded")
-    
-    # Validate file type
-    allowed_extensions = {'.wav', '.mp3', '.m4a', '.flac', '.ogg', '.webm'}
-    file_ext = os.path.splitext(file.filename)[1].lower()
+    _validate_file_type(file.filename)
+    decode_options = _decode_options(quality)
+    whisper_model = await _get_model(model)
+    resolved_language = _resolve_language(
+        language,
+        whisper_model.supported_languages,
+        session_id
+    )
     
-    if file_ext not in allowed_extensions:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Unsupported file type: {file_ext}. Allowed: {allowed_extensions}"
+    try:
+        logger.info(f"Processing audio file: {file.filename} ({file.size} bytes)")
+        
+        cache_key, result, audio = await _load_upload(
+            file,
+            ("transcribe", resolved_language, timestamp, model, quality)
         )
-    
-    # Save uploaded file to temporary location
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-        try:
-            content = await file.read()
-            temp_file.write(content)
-            temp_file_path = temp_file.name
-            
-            logger.info(f"Processing audio file: {file.filename} ({len(content)} bytes)")
-            
-            # Transcribe with Whisper
-            result = whisper_model.transcribe(
-                temp_file_path,
-                language=language if language in ["si", "en"] else None,
-                word_timestamps=timestamp
+        
+        if result is None:
+            # Transcribe with Whisper off the event loop, bounded by the semaphore
+            result = await _run_inference(
+                _core_transcribe,
+                whisper_model,
+                audio,
+                resolved_language,
+                timestamp,
+                **decode_options
             )
             
-            response = {
-                "text": result["text"].strip(),
-                "language": result.get("language", language),
-                "duration": result.get("duration", 0),
-                "filename": file.filename
-            }
-            
-            if timestamp and "segments" in result:
-                response["segments"] = [
-                    {
-                        "start": segment["start"],
-                        "end": segment["end"],
-                        "text": segment["text"]
-                    }
-                    for segment in result["segments"]
-                ]
-            
-            logger.info(f"Transcription completed: {len(response['text'])} characters")
-            return JSONResponse(content=response)
-            
-        except Exception as e:
-            logger.error(f"Transcription failed: {e}")
-            raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
+            _cache_put(cache_key, result)
+        else:
+            logger.info(f"Cache hit for {file.filename}")
+        
+        if resolved_language is None:
+            _remember_language(session_id, result["language"])
         
-        finally:
-            # Clean up temporary file
-            try:
-                os.unlink(temp_file_path)
-            except OSError:
-                pass
+        response = {**result, "filename": file.filename}
+        logger.info(f"Transcription completed: {len(response['text'])} characters")
+        return JSONResponse(content=response)
+        
+    except Exception as e:
+        logger.error(f"Transcription failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Transcription failed: {str(e)}")
 
 @app.post("/transcribe-batch")
 async def transcribe_batch(
     files: list[UploadFile] = File(...),
-    language: Optional[str] = Form("si")
+    language: Optional[str] = Form("si"),
+    model: str = Form(DEFAULT_MODEL),
+    session_id: Optional[str] = Form(None),
+    quality: str = Form(DEFAULT_QUALITY)
 ):
     """
-    Transcribe multiple audio files
+    Transcribe multiple audio files in a single batched decode
+    
+    With language "auto" (and no language cached for the session), every
+    speech region is decoded in the language detected for it, so
+    mixed-language batches transcribe correctly. The reported language is
+    detected once for the whole batch, from the first 30 s of the first file
+    with speech, and is not per file.
     
     Args:
         files: List of audio files
-        language: Language code for transcription
+        language: Language code for transcription, or auto
+        model: Whisper model size to use (see WHISPER_MODELS)
+        session_id: Client session; auto-detected languages are reused within it
+        quality: Decoding preset, "fast" (greedy) or "accurate" (beam search)
     
     Returns:
         List of transcription results
     """
-    results = []
+    decode_options = _decode_options(quality)
+    whisper_model = await _get_model(model)
+    resolved_language = _resolve_language(
+        language,
+        whisper_model.supported_languages,
+        session_id
+    )
     
-    for file in files:
-        try:
-            # Create a single-file upload for the transcribe endpoint
-            single_file = UploadFile(
-                filename=file.filename,
-                file=file.file,
-                content_type=file.content_type
-            )
-            
-            result = await transcribe_audio(
-                file=single_file,
-                language=language,
-                timestamp=False
-            )
-            
-            results.append({
+    results = [None] * len(files)
+    indices = []
+    cache_keys = []
+    audios = []
+    
+    async def load(file: UploadFile) -> tuple:
+        _validate_file_type(file.filename)
+        # Batched decoding can differ slightly from /transcribe's, so the two
+        # endpoints keep separate cache entries
+        return await _load_upload(file, ("batch", resolved_language, model, quality))
+    
+    # Hash and decode every upload concurrently on the worker pool, reading
+    # each upload stream in place
+    uploads = await asyncio.gather(*(load(file) for file in files), return_exceptions=True)
+    
+    for index, (file, upload) in enumerate(zip(files, uploads)):
+        if isinstance(upload, Exception):
+            error = upload.detail if isinstance(upload, HTTPException) else str(upload)
+            logger.error(f"Failed to decode {file.filename}: {error}")
+            results[index] = {"filename": file.filename, "status": "error", "error": error}
+            continue
+        
+        cache_key, cached, audio = upload
+        if cached is not None:
+            results[index] = {
                 "filename": file.filename,
                 "status": "success",
-                "result": result.body.decode() if hasattr(result, 'body') else result
-            })
-            
+                "result": {**cached, "filename": file.filename}
+            }
+            continue
+        
+        audios.append(audio)
+        indices.append(index)
+        cache_keys.append(cache_key)
+    
+    if audios:
+        try:
+            if STT_BACKEND == "faster-whisper":
+                transcriptions = await _run_inference(
+                    _transcribe_batched,
+                    BatchedInferencePipeline(model=whisper_model),
+                    audios,
+                    resolved_language,
+                    **decode_options
+                )
+            else:
+                transcriptions = await _run_inference(
+                    _transcribe_sequential,
+                    whisper_model,
+                    audios,
+                    resolved_language,
+                    **decode_options
+                )
         except Exception as e:
-            logger.error(f"Failed to transcribe {file.filename}: {e}")
-            results.append({
-                "filename": file.filename,
-                "status": "error",
-                "error": str(e)
-            })
+            logger.error(f"Batch transcription failed: {e}")
+            transcriptions = [e] * len(audios)
+        
+        for index, cache_key, transcription in zip(indices, cache_keys, transcriptions):
+            filename = files[index].filename
+            if isinstance(transcription, Exception):
+                results[index] = {
+                    "filename": filename,
+                    "status": "error",
+                    "error": str(transcription)
+                }
+            else:
+                _cache_put(cache_key, transcription)
+                if resolved_language is None:
+                    _remember_language(session_id, transcription["language"])
+                results[index] = {
+                    "filename": filename,
+                    "status": "success",
+                    "result": {**transcription, "filename": filename}
+                }
     
+    logger.info(f"Batch transcription completed: {len(indices)}/{len(files)} files decoded")
     return JSONResponse(content={"results": results})
 
+@app.websocket("/stream")
+async def stream_transcription(
+    websocket: WebSocket,
+    language: Optional[str] = "si",
+    model: str = DEFAULT_MODEL,
+    session_id: Optional[str] = None,
+    quality: str = DEFAULT_QUALITY
+):
+    """
+    Stream transcription over a WebSocket
+    
+    The client sends 16 kHz mono 16-bit little-endian PCM as binary frames
+    and the text frame "end" once it is done. The server replies with
+    {"type": "committed"} messages for words two rounds agreed on,
+    {"type": "partial"} with the current tentative text, and a closing
+    {"type": "final"} carrying the full transcript. On failure it sends
+    {"type": "error"} and closes with 1008 (invalid parameters) or 1011.
+    
+    Args:
+        language: Language code, or auto to detect on the first round (query parameter)
+        model: Whisper model size to use (query parameter)
+        session_id: Client session; auto-detected languages are reused within it
+        quality: Decoding preset, "fast" (greedy) or "accurate" (beam search)
+    """
+    await websocket.accept()
+    try:
+        decode_options = _decode_options(quality)
+        whisper_model = await _get_model(model)
+        stream_language = _resolve_language(
+            language,
+            whisper_model.supported_languages,
+            session_id
+        )
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "error": e.detail})
+        await websocket.close(code=1008 if e.status_code < 500 else 1011)
+        return
+    
+    agreement = LocalAgreement()
+    step_samples = int(SAMPLE_RATE * STREAM_STEP_SECONDS)
+    max_samples = int(SAMPLE_RATE * STREAM_BUFFER_SECONDS)
+    buffer = StreamBuffer(max_samples + step_samples)
+    buffer_offset = 0.0
+    pending_samples = 0
+    # Frames need not end on a sample boundary; an odd trailing byte is
+    # carried over to the front of the next frame
+    leftover = b""
+    
+    async def transcribe_round() -> tuple:
+        """Re-transcribe the buffer and feed the hypothesis to the agreement"""
+        nonlocal stream_language
+        # Committed text that has already been trimmed out of the buffer
+        # is passed as the prompt to keep the decoder's context
+        prompt = _join_words([
+            word for word in agreement.committed if word.end <= buffer_offset
+        ])
+        words, detected_language = await _run_inference(
+            _stream_hypothesis,
+            whisper_model,
+            buffer.audio,
+            buffer_offset,
+            stream_language,
+            prompt[-200:],
+            **decode_options
+        )
+        
+        # Detect the language on the first round only and pin it afterwards
+        if stream_language is None and detected_language:
+            stream_language = detected_language
+            _remember_language(session_id, detected_language)
+        
+        return agreement.insert(words)
+    
+    async def send_committed(words: List[StreamWord]):
+        if words:
+            await websocket.send_json({
+                "type": "committed",
+                "text": _join_words(words),
+                "start": words[0].start,
+                "end": words[-1].end
+            })
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            
+            if message.get("text") == "end":
+                # Audio received since the last round has not been seen by
+                # the model yet, so transcribe it before flushing
+                committed = []
+                if pending_samples:
+                    committed, _ = await transcribe_round()
+                await send_committed(committed + agreement.flush())
+                await websocket.send_json({
+                    "type": "final",
+                    "text": _join_words(agreement.committed)
+                })
+                await websocket.close()
+                return
+            
+            data = message.get("bytes")
+            if not data:
+                continue
+            data = leftover + data
+            usable = len(data) - len(data) % 2
+            leftover = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype="<i2")
+            buffer.append(samples.astype(np.float32) / 32768.0)
+            pending_samples += len(samples)
+            if pending_samples < step_samples:
+                continue
+            pending_samples = 0
+            
+            committed, tentative = await transcribe_round()
+            await send_committed(committed)
+            await websocket.send_json({"type": "partial", "text": _join_words(tentative)})
+            
+            # Committed audio is never decoded again: cut the buffer at the
+            # last committed word, and FIFO-trim to the cap if nothing has
+            # been committed recently
+            cut = int((agreement.committed_end - buffer_offset) * SAMPLE_RATE) if committed else 0
+            cut = min(max(cut, len(buffer) - max_samples), len(buffer))
+            if cut > 0:
+                buffer.drop(cut)
+                buffer_offset += cut / SAMPLE_RATE
+    
+    except WebSocketDisconnect:
+        logger.info("Stream client disconnected")
+    except Exception as e:
+        logger.error(f"Stream transcription failed: {e}")
+        await websocket.send_json({"type": "error", "error": f"Transcription failed: {str(e)}"})
+        await websocket.close(code=1011)
+
+def _default_model_languages() -> List[str]:
+    """Codes the default model accepts, or every Whisper code before it has loaded"""
+    model = whisper_models.get(DEFAULT_MODEL)
+    return model.supported_languages if model is not None else list(LANGUAGE_NAMES)
+
 @app.get("/languages")
 async def supported_languages():
     """Get list of supported languages"""
     return {
         "supported_languages": [
-            {"code": "si", "name": "Sinhala"},
-            {"code": "en", "name": "English"},
+            *(
+                {"code": code, "name": LANGUAGE_NAMES.get(code, code)}
+                for code in _default_model_languages()
+            ),
             {"code": "auto", "name": "Auto-detect"}
         ],
         "default": "si"
@@ -197,9 +1196,16 @@ async def supported_languages():
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
+    # Each worker process holds its own model copy, so keep WORKERS=1 on GPU
+    # hosts and scale out with container replicas instead
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=port,
-        reload=os.getenv("ENVIRONMENT") == "development"
+        reload=os.getenv("ENVIRONMENT") == "development",
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WORKERS", "1")),
+        limit_concurrency=int(os.getenv("LIMIT_CONCURRENCY", "64")),
+        backlog=2048
     )
@@ -2,10 +2,18 @@
 Tests for STT service
 """
 
+import io
 import pytest
+import sys
 import tempfile
-import os
+import time
+import wave
+from collections import OrderedDict
+from types import SimpleNamespace
+import numpy as np
+from fastapi import WebSocketDisconnect
 from fastapi.testclient import TestClient
+import main
 from main import app
 
 client = TestClient(app)
@@ -17,6 +25,42 @@ def create_test_audio_file(content: bytes = b"fake_audio_data"):
     temp_file.close()
     return temp_file.name
 
+def create_wav_bytes(seconds: float = 1.0) -> bytes:
+    """Create a silent 16 kHz mono WAV file in memory"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(16000)
+        wav_file.writeframes(b"\x00\x00" * int(16000 * seconds))
+    return buffer.getvalue()
+
+class FakeModel:
+    """Stand-in for a WhisperModel that records each transcribe() call"""
+    
+    def __init__(self):
+        self.calls = []
+        self.audios = []
+        self.segments = []
+        self.language = "en"
+        self.supported_languages = ["en", "si"]
+    
+    def transcribe(self, audio, **options):
+        self.calls.append(options)
+        self.audios.append(audio)
+        info = SimpleNamespace(language=self.language, duration=len(audio) / main.SAMPLE_RATE)
+        return iter(self.segments), info
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Serve the default model from a FakeModel, with empty caches"""
+    model = FakeModel()
+    monkeypatch.setattr(main, "whisper_models", {main.DEFAULT_MODEL: model})
+    monkeypatch.setattr(main, "_model_last_used", {main.DEFAULT_MODEL: time.monotonic()})
+    monkeypatch.setattr(main, "_transcription_cache", OrderedDict())
+    monkeypatch.setattr(main, "_session_languages", OrderedDict())
+    return model
+
 def test_health_check():
     """Test health check endpoint"""
     response = client.get("/health")
@@ -38,6 +82,17 @@ def test_supported_languages():
     languages = [lang["code"] for lang in data["supported_languages"]]
     assert "si" in languages
     assert "en" in languages
+    assert "ta" in languages
+    assert "auto" in languages
+
+def test_supported_languages_follow_the_loaded_model(fake_model):
+    """Test that /languages lists what the default model accepts"""
+    data = client.get("/languages").json()
+    assert data["supported_languages"] == [
+        {"code": "en", "name": "English"},
+        {"code": "si", "name": "Sinhala"},
+        {"code": "auto", "name": "Auto-detect"}
+    ]
 
 def test_transcribe_invalid_file_type():
     """Test transcription with invalid file type"""
@@ -60,12 +115,495 @@ def test_transcribe_missing_file():
     response = client.post("/transcribe")
     assert response.status_code == 422  # Validation error
 
+def test_transcribe_unsupported_model():
+    """Test transcription with a model size outside WHISPER_MODELS"""
+    response = client.post(
+        "/transcribe",
+        files={"file": ("test.wav", create_wav_bytes(), "audio/wav")},
+        data={"model": "huge"}
+    )
+    assert response.status_code == 400
+    assert "Unsupported model" in response.json()["detail"]
+
+def test_models_load_lazily_without_preload(fake_model, monkeypatch):
+    """Test that a model missing from whisper_models is loaded on first use"""
+    loaded = []
+    
+    def load_whisper_model(model_size):
+        loaded.append(model_size)
+        main.whisper_models[model_size] = fake_model
+        return fake_model
+    
+    monkeypatch.setattr(main, "whisper_models", {})
+    monkeypatch.setattr(main, "load_whisper_model", load_whisper_model)
+    
+    for _ in range(2):
+        response = client.post(
+            "/transcribe",
+            files={"file": ("test.wav", create_wav_bytes(), "audio/wav")},
+            data={"language": "en"}
+        )
+        assert response.status_code == 200
+    
+    assert loaded == [main.DEFAULT_MODEL]
+
+def test_idle_models_are_evicted(fake_model, monkeypatch):
+    """Test that non-default models unused for MODEL_IDLE_TTL are dropped"""
+    monkeypatch.setattr(main, "MODEL_IDLE_TTL", 60)
+    main.whisper_models["tiny"] = FakeModel()
+    main._model_last_used["tiny"] = time.monotonic() - 120
+    main._model_last_used[main.DEFAULT_MODEL] = time.monotonic() - 120
+    
+    response = client.post(
+        "/transcribe",
+        files={"file": ("test.wav", create_wav_bytes(), "audio/wav")},
+        data={"language": "en"}
+    )
+    assert response.status_code == 200
+    assert list(main.whisper_models) == [main.DEFAULT_MODEL]
+
 def test_transcribe_batch_empty():
     """Test batch transcription with no files"""
     response = client.post("/transcribe-batch")
     assert response.status_code == 422  # Validation error
 
-def test_transcribe_with_language_parameter():
+class FakeBatchedModel:
+    """Stand-in for a BatchedInferencePipeline emitting one segment per window"""
+    
+    def transcribe(self, audio, language=None, clip_timestamps=None, **kwargs):
+        # faster-whisper rounds segment times to the millisecond
+        segments = [
+            SimpleNamespace(start=round(clip["start"] / main.SAMPLE_RATE, 3), text=f" window{i}")
+            for i, clip in enumerate(clip_timestamps)
+        ]
+        return iter(segments), SimpleNamespace(language=language)
+
+def fixed_windows(audio):
+    """Cut a clip into back-to-back 30 s windows, standing in for VAD regions"""
+    window = main.SAMPLE_RATE * main.CHUNK_SECONDS
+    return [
+        {"start": start, "end": min(start + window, len(audio))}
+        for start in range(0, len(audio), window)
+    ]
+
+def test_transcribe_batched_maps_segments_to_files(monkeypatch):
+    """Test that one batched decode is split back into per-file results"""
+    monkeypatch.setattr(main, "_speech_regions", fixed_windows)
+    audios = [
+        np.zeros(main.SAMPLE_RATE * 5, dtype=np.float32),
+        np.zeros(main.SAMPLE_RATE * 45, dtype=np.float32)
+    ]
+    results = main._transcribe_batched(FakeBatchedModel(), audios, "en")
+    
+    assert [result["text"] for result in results] == ["window0", "window1 window2"]
+    assert [result["duration"] for result in results] == [5, 45]
+
+def test_transcribe_batched_maps_unaligned_clip_lengths(monkeypatch):
+    """Test segment mapping when clip offsets don't fall on a millisecond"""
+    monkeypatch.setattr(main, "_speech_regions", fixed_windows)
+    audios = [
+        np.zeros(80003, dtype=np.float32),
+        np.zeros(48000, dtype=np.float32),
+        np.zeros(7, dtype=np.float32)
+    ]
+    results = main._transcribe_batched(FakeBatchedModel(), audios, "en")
+    
+    assert [result["text"] for result in results] == ["window0", "window1", "window2"]
+
+def test_transcribe_batched_skips_silent_clips():
+    """Test that clips without speech are not sent to the batched decode"""
+    silence = [np.zeros(main.SAMPLE_RATE * 40, dtype=np.float32)]
+    results = main._transcribe_batched(FakeBatchedModel(), silence, "en")
+    
+    assert results == [{"text": "", "language": "en", "duration": 40}]
+
+def test_transcribe_cache_skips_repeat_inference(fake_model):
+    """Test that re-uploading identical audio is served from the cache"""
+    fake_model.segments = [SimpleNamespace(start=0.0, end=1.0, text=" hello")]
+    audio = create_wav_bytes()
+    
+    for filename in ["first.wav", "second.wav"]:
+        response = client.post(
+            "/transcribe",
+            files={"file": (filename, audio, "audio/wav")},
+            data={"language": "en"}
+        )
+        assert response.status_code == 200
+        assert response.json()["text"] == "hello"
+        assert response.json()["filename"] == filename
+    
+    assert len(fake_model.calls) == 1
+
+def test_long_audio_keeps_phrase_timestamps_in_batched_decode(fake_model, monkeypatch):
+    """Test that audio over 30 s is batched with timestamp tokens when they are requested"""
+    batched = []
+    
+    class FakePipeline:
+        def __init__(self, model):
+            pass
+        
+        def transcribe(self, audio, **options):
+            batched.append(options)
+            return iter([]), SimpleNamespace(language="en")
+    
+    monkeypatch.setattr(main, "BatchedInferencePipeline", FakePipeline)
+    
+    for timestamp in ["true", "false"]:
+        response = client.post(
+            "/transcribe",
+            files={"file": ("long.wav", create_wav_bytes(31.0), "audio/wav")},
+            data={"language": "en", "timestamp": timestamp}
+        )
+        assert response.status_code == 200
+    
+    with_timestamps, without_timestamps = batched
+    assert with_timestamps["without_timestamps"] is False
+    assert with_timestamps["word_timestamps"] is True
+    assert with_timestamps["batch_size"] == main.BATCH_SIZE
+    assert without_timestamps["without_timestamps"] is True
+    assert fake_model.calls == []
+
+def test_transcribe_batch_endpoint(fake_model, monkeypatch):
+    """Test /transcribe-batch with cache hits, bad uploads and one batched decode"""
+    decodes = []
+    
+    class FakePipeline:
+        def __init__(self, model):
+            assert model is fake_model
+        
+        def transcribe(self, audio, language=None, clip_timestamps=None, **options):
+            decodes.append(clip_timestamps)
+            segments = [
+                SimpleNamespace(
+                    start=round(clip["start"] / main.SAMPLE_RATE, 3),
+                    text=f" {(clip['end'] - clip['start']) // main.SAMPLE_RATE}s"
+                )
+                for clip in clip_timestamps
+            ]
+            return iter(segments), SimpleNamespace(language=language)
+    
+    monkeypatch.setattr(main, "BatchedInferencePipeline", FakePipeline)
+    monkeypatch.setattr(main, "_speech_regions", fixed_windows)
+    
+    def post(files):
+        response = client.post(
+            "/transcribe-batch",
+            files=[("files", file) for file in files],
+            data={"language": "en"}
+        )
+        assert response.status_code == 200
+        return response.json()["results"]
+    
+    cached = ("cached.wav", create_wav_bytes(1.0), "audio/wav")
+    post([cached])
+    results = post([
+        ("fresh.wav", create_wav_bytes(2.0), "audio/wav"),
+        ("notes.txt", b"not audio", "text/plain"),
+        cached,
+        ("corrupt.wav", b"RIFF garbage", "audio/wav"),
+        ("other.wav", create_wav_bytes(3.0), "audio/wav")
+    ])
+    
+    assert [result["filename"] for result in results] == [
+        "fresh.wav", "notes.txt", "cached.wav", "corrupt.wav", "other.wav"
+    ]
+    assert [result["status"] for result in results] == [
+        "success", "error", "success", "error", "success"
+    ]
+    assert "Unsupported file type" in results[1]["error"]
+    assert [results[i]["result"]["text"] for i in (0, 2, 4)] == ["2s", "1s", "3s"]
+    assert results[2]["result"]["filename"] == "cached.wav"
+    
+    # The cache hit and failed uploads are left out of the second decode
+    assert len(decodes) == 2
+    assert [clip["end"] - clip["start"] for clip in decodes[1]] == [32000, 48000]
+
+def test_transcribe_and_batch_keep_separate_cache_entries(fake_model, monkeypatch):
+    """Test that a batch decode is not served from a /transcribe cache entry"""
+    batched = []
+    
+    class FakePipeline:
+        def __init__(self, model):
+            pass
+        
+        def transcribe(self, audio, language=None, clip_timestamps=None, **options):
+            batched.append(clip_timestamps)
+            segments = [SimpleNamespace(start=0.0, text=" batched")]
+            return iter(segments), SimpleNamespace(language=language)
+    
+    monkeypatch.setattr(main, "BatchedInferencePipeline", FakePipeline)
+    monkeypatch.setattr(main, "_speech_regions", fixed_windows)
+    fake_model.segments = [SimpleNamespace(start=0.0, end=1.0, text=" single")]
+    audio = create_wav_bytes()
+    
+    response = client.post(
+        "/transcribe",
+        files={"file": ("test.wav", audio, "audio/wav")},
+        data={"language": "en"}
+    )
+    assert response.json()["text"] == "single"
+    
+    response = client.post(
+        "/transcribe-batch",
+        files={"files": ("test.wav", audio, "audio/wav")},
+        data={"language": "en"}
+    )
+    assert response.json()["results"][0]["result"]["text"] == "batched"
+    assert len(batched) == 1
+
+def test_auto_language_is_detected_once_per_session(fake_model):
+    """Test that an auto-detected language is reused for the rest of a session"""
+    fake_model.language = "si"
+    
+    for seconds in [1.0, 2.0]:
+        response = client.post(
+            "/transcribe",
+            files={"file": ("test.wav", create_wav_bytes(seconds), "audio/wav")},
+            data={"language": "auto", "session_id": "client-1"}
+        )
+        assert response.status_code == 200
+        assert response.json()["language"] == "si"
+    
+    assert [call["language"] for call in fake_model.calls] == [None, "si"]
+
+def test_transcribe_unsupported_language(fake_model):
+    """Test transcription with a language code the loaded model does not support"""
+    for language in ["xx", "ta"]:
+        response = client.post(
+            "/transcribe",
+            files={"file": ("test.wav", create_wav_bytes(), "audio/wav")},
+            data={"language": language}
+        )
+        assert response.status_code == 400
+        assert "Unsupported language" in response.json()["detail"]
+    
+    assert fake_model.calls == []
+
+def test_batch_auto_language_detects_per_region(monkeypatch):
+    """Test that auto-language batches ask the pipeline to detect per region"""
+    calls = []
+    
+    class RecordingPipeline(FakeBatchedModel):
+        def transcribe(self, audio, **options):
+            calls.append(options)
+            return super().transcribe(audio, **options)
+    
+    monkeypatch.setattr(main, "_speech_regions", fixed_windows)
+    audio = [np.zeros(main.SAMPLE_RATE, dtype=np.float32)]
+    main._transcribe_batched(RecordingPipeline(), audio, None)
+    main._transcribe_batched(RecordingPipeline(), audio, "si")
+    
+    assert [call["multilingual"] for call in calls] == [True, False]
+
+def test_quality_presets_select_decoding_options(fake_model):
+    """Test that the quality form field picks the decoding preset"""
+    for quality in ["fast", "accurate"]:
+        response = client.post(
+            "/transcribe",
+            files={"file": ("test.wav", create_wav_bytes(), "audio/wav")},
+            data={"language": "en", "quality": quality}
+        )
+        assert response.status_code == 200
+    
+    fast, accurate = fake_model.calls
+    assert fast["beam_size"] == 1
+    assert fast["condition_on_previous_text"] is False
+    assert accurate["beam_size"] == 5
+    
+    response = client.post(
+        "/transcribe",
+        files={"file": ("test.wav", create_wav_bytes(), "audio/wav")},
+        data={"language": "en", "quality": "best"}
+    )
+    assert response.status_code == 400
+    assert "Unsupported quality" in response.json()["detail"]
+
+def test_local_agreement_commits_words_two_rounds_agree_on():
+    """Test that LocalAgreement-2 only commits the common prefix of consecutive rounds"""
+    agreement = main.LocalAgreement()
+    hello = main.StreamWord(0.0, 0.5, " hello")
+    there = main.StreamWord(0.5, 1.0, " there")
+    
+    committed, tentative = agreement.insert([hello, main.StreamWord(0.5, 1.0, " the")])
+    assert committed == []
+    
+    committed, tentative = agreement.insert([hello, there])
+    assert committed == [hello]
+    assert tentative == [there]
+    
+    # The re-transcribed buffer repeats the committed word before new ones
+    general = main.StreamWord(1.0, 1.5, " general")
+    committed, tentative = agreement.insert([hello, there, general])
+    assert committed == [there]
+    assert tentative == [general]
+    
+    assert agreement.flush() == [general]
+    assert main._join_words(agreement.committed) == "hello there general"
+
+def test_stream_sends_partials_and_final_transcript(fake_model):
+    """Test the /stream WebSocket protocol with a fake model"""
+    words = [
+        SimpleNamespace(start=0.0, end=0.5, word=" hello"),
+        SimpleNamespace(start=0.5, end=1.0, word=" world")
+    ]
+    fake_model.segments = [SimpleNamespace(words=words)]
+    one_second = b"\x00\x00" * main.SAMPLE_RATE
+    
+    with client.websocket_connect("/stream?language=en") as websocket:
+        websocket.send_bytes(one_second)
+        assert websocket.receive_json() == {"type": "partial", "text": "hello world"}
+        websocket.send_bytes(one_second)
+        assert websocket.receive_json()["text"] == "hello world"
+        assert websocket.receive_json() == {"type": "partial", "text": ""}
+        websocket.send_text("end")
+        assert websocket.receive_json() == {"type": "final", "text": "hello world"}
+
+def test_stream_buffer_appends_and_drops_samples():
+    """Test that StreamBuffer grows past its capacity and drops from the front"""
+    buffer = main.StreamBuffer(4)
+    buffer.append(np.arange(3, dtype=np.float32))
+    buffer.append(np.arange(3, 6, dtype=np.float32))
+    assert buffer.audio.tolist() == [0, 1, 2, 3, 4, 5]
+    
+    buffer.drop(4)
+    assert buffer.audio.tolist() == [4, 5]
+    buffer.append(np.array([6], dtype=np.float32))
+    assert buffer.audio.tolist() == [4, 5, 6]
+
+def test_stream_trims_committed_audio_from_the_buffer(fake_model):
+    """Test that audio up to the last committed word is not decoded again"""
+    words = [
+        SimpleNamespace(start=0.0, end=0.5, word=" hello"),
+        SimpleNamespace(start=0.5, end=1.0, word=" world")
+    ]
+    fake_model.segments = [SimpleNamespace(words=words)]
+    one_second = b"\x00\x00" * main.SAMPLE_RATE
+    
+    with client.websocket_connect("/stream?language=en") as websocket:
+        for _ in range(3):
+            websocket.send_bytes(one_second)
+            while websocket.receive_json()["type"] != "partial":
+                pass
+    
+    assert [len(audio) for audio in fake_model.audios] == [16000, 32000, 32000]
+
+def test_stream_transcribes_audio_received_after_the_last_round(fake_model):
+    """Test that audio shorter than a stream step still reaches the final transcript"""
+    fake_model.segments = [
+        SimpleNamespace(words=[SimpleNamespace(start=0.0, end=0.4, word=" bye")])
+    ]
+    half_second = b"\x00\x00" * (main.SAMPLE_RATE // 2)
+    
+    with client.websocket_connect("/stream?language=en") as websocket:
+        websocket.send_bytes(half_second)
+        websocket.send_text("end")
+        assert websocket.receive_json()["type"] == "committed"
+        assert websocket.receive_json() == {"type": "final", "text": "bye"}
+    
+    assert len(fake_model.calls) == 1
+
+def test_stream_keeps_sample_alignment_across_odd_frames(fake_model):
+    """Test that a sample split across two binary frames is reassembled"""
+    samples = np.arange(1, main.SAMPLE_RATE + 1, dtype="<i2").tobytes()
+    
+    with client.websocket_connect("/stream?language=en") as websocket:
+        websocket.send_bytes(samples[:3])
+        websocket.send_bytes(samples[3:])
+        websocket.send_text("end")
+        while websocket.receive_json()["type"] != "final":
+            pass
+    
+    expected = np.arange(1, main.SAMPLE_RATE + 1) / 32768.0
+    np.testing.assert_allclose(fake_model.audios[0], expected)
+
+def test_stream_reports_errors_before_closing(fake_model, monkeypatch):
+    """Test that /stream sends an error message and a close code on failure"""
+    with client.websocket_connect("/stream?quality=best") as websocket:
+        assert websocket.receive_json()["type"] == "error"
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1008
+    
+    def fail(audio, **options):
+        raise RuntimeError("cuda oom")
+    
+    monkeypatch.setattr(fake_model, "transcribe", fail)
+    with client.websocket_connect("/stream?language=en") as websocket:
+        websocket.send_bytes(b"\x00\x00" * main.SAMPLE_RATE)
+        assert websocket.receive_json() == {
+            "type": "error",
+            "error": "Transcription failed: cuda oom"
+        }
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_json()
+        assert closed.value.code == 1011
+
+class FakeWhisperPipeline:
+    """Stand-in for openvino_genai.WhisperPipeline"""
+    
+    def __init__(self, model_dir, device=None):
+        self.model_dir = model_dir
+        self.calls = []
+    
+    def generate(self, audio, **options):
+        self.calls.append(options)
+        chunks = [
+            SimpleNamespace(start_ts=0.0, end_ts=0.5, text=" hello"),
+            SimpleNamespace(start_ts=0.5, end_ts=1.0, text=" world")
+        ]
+        return SimpleNamespace(chunks=chunks)
+
+def test_openvino_backend(fake_model, monkeypatch):
+    """Test the OpenVINO adapter against a stub openvino_genai module"""
+    monkeypatch.setitem(
+        sys.modules,
+        "openvino_genai",
+        SimpleNamespace(WhisperPipeline=FakeWhisperPipeline)
+    )
+    monkeypatch.setattr(main, "STT_BACKEND", "openvino")
+    model = main.OpenVINOWhisperModel("base")
+    monkeypatch.setitem(main.whisper_models, main.DEFAULT_MODEL, model)
+    assert model.pipeline.model_dir.endswith("whisper-base")
+    
+    response = client.post(
+        "/transcribe",
+        files={"file": ("test.wav", create_wav_bytes(), "audio/wav")},
+        data={"language": "si", "timestamp": "true"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["text"] == "hello world"
+    assert data["language"] == "si"
+    assert data["segments"] == [
+        {"start": 0.0, "end": 0.5, "text": " hello"},
+        {"start": 0.5, "end": 1.0, "text": " world"}
+    ]
+    assert model.pipeline.calls == [{"return_timestamps": True, "language": "<|si|>"}]
+    
+    # Batches fall back to one sequential decode per file
+    response = client.post(
+        "/transcribe-batch",
+        files=[
+            ("files", ("first.wav", create_wav_bytes(1.0), "audio/wav")),
+            ("files", ("second.wav", create_wav_bytes(2.0), "audio/wav"))
+        ],
+        data={"language": "en"}
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["result"]["text"] for result in results] == ["hello world"] * 2
+    assert [result["result"]["duration"] for result in results] == [1.0, 2.0]
+    assert len(model.pipeline.calls) == 3
+    
+    response = client.post(
+        "/transcribe",
+        files={"file": ("test.wav", create_wav_bytes(), "audio/wav")},
+        data={"language": "auto"}
+    )
+    assert response.status_code == 400
+    assert "auto-detection" in response.json()["detail"]
+
+def test_transcribe_with_language_parameter(fake_model):
     """Test transcription with language parameter"""
     # Create a minimal WAV file header (this won't actually transcribe but tests the endpoint)
     wav_header = b'RIFF$\x00\x00\x00WAVEfmt \x10\x00\x00\x00\x01\x00\x01\x00D\xac\x00\x00\x88X\x01\x00\x02\x00\x10\x00data\x00\x00\x00\x00'